@@ -4,17 +4,32 @@ import asyncio
 import os
 import random
 import sys
+import threading
+import time
 import json
 import aiohttp
+import orjson
 from datetime import datetime, timedelta
 from typing import Optional, List
 import tempfile
 import platform
 import re
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 
 # Fix for Windows event loop policy
 if platform.system() == 'Windows':
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+else:
+    # Use uvloop's faster event loop when installed; JarvisBot creates its loop from this policy
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
 # Import telegram libraries
 try:
@@ -28,6 +43,7 @@ try:
     from apscheduler.schedulers.asyncio import AsyncIOScheduler
     from apscheduler.triggers.date import DateTrigger
     from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
 except ImportError as e:
     print(f"❌ خطا در وارد کردن apscheduler: {e}")
     sys.exit(1)
@@ -59,39 +75,299 @@ if not OPENROUTER_API_KEY:
 DATABASE_PATH = "jarvis_bot.db"
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 DEFAULT_MODEL = "openai/gpt-3.5-turbo"
+MAX_CONVERSATIONS = 500  # users whose AI history is kept in memory
+AI_CONV_BATCH_SIZE = 8  # buffered ai_conversations rows that trigger a write
+OFFLINE_BATCH_SIZE = 50  # buffered offline messages that trigger a write
+OFFLINE_MAX_PER_USER = 20  # offline messages stored per sender until /online
+OFFLINE_BUFFER_MAX = 1000  # buffered offline rows kept if writes fall behind
+TELEGRAM_MAX_MESSAGE = 4096  # characters per Telegram text message
+
+# SQLite tuning applied to every connection (journal_mode persists in the file,
+# the rest are per-connection settings)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Relative time expressions understood by parse_time_string
+_TIME_PATTERNS = (
+    (re.compile(r'(\d+)\s*(?:دقیقه|minute|min|m)'), 'm'),
+    (re.compile(r'(\d+)\s*(?:ساعت|hour|h)'), 'h'),
+    (re.compile(r'(\d+)\s*(?:روز|day|d)'), 'd'),
+)
+_TIME_FALLBACK = re.compile(r'^(\d+)([mhd])$')
+_TIME_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+# AI function call: "EXECUTE_FUNCTION: name | {json parameters}". The name is
+# followed by the end of the line or by "|" and the parameters, which are
+# decoded with raw_decode so they may span lines and trailing text is ignored.
+_FUNC_PREFIX = "EXECUTE_FUNCTION:"
+_FUNC_RE = re.compile(r'EXECUTE_FUNCTION:[ \t]*(\w+)[ \t]*(?:(\|)\s*|$)', re.M)
+_JSON_DECODER = json.JSONDecoder()
+
+# Static part of the AI system prompt; only the context line varies per call
+SYSTEM_PROMPT_PREFIX = """You are Jarvis, a helpful Persian/Farsi speaking AI assistant integrated into a Telegram bot. You can understand natural language and execute functions automatically.
+
+IMPORTANT: You can execute the following functions by analyzing user intent:
+
+1. add_task - When user wants to add a task/todo
+   Parameters: {"description": "task description"}
+   
+2. list_tasks - When user asks to see tasks/todos
+   Parameters: {}
+   
+3. complete_task - When user wants to mark a task as done
+   Parameters: {"task_number": "task id, the #number shown in the task list"}
+   
+4. add_note - When user wants to save a note
+   Parameters: {"content": "note content"}
+   
+5. list_notes - When user asks to see notes
+   Parameters: {}
+   
+6. set_reminder - When user wants to set a reminder
+   Parameters: {"time": "time format like 30m, 2h, 1d", "description": "reminder text"}
+   
+7. get_tip - When user asks for tips or learning
+   Parameters: {}
+   
+8. get_quote - When user asks for motivation or quotes
+   Parameters: {}
+   
+9. get_summary - When user asks for daily summary
+   Parameters: {}
+
+EXECUTION RULES:
+- If user intent matches a function, respond with: EXECUTE_FUNCTION: function_name | parameters_json
+- If multiple functions needed, pick the most relevant one
+- If no function needed, respond normally in Persian
+- Always be conversational and helpful
+
+Examples:
+User: "یه وظیفه اضافه کن: خرید نان"
+Response: EXECUTE_FUNCTION: add_task | {"description": "خرید نان"}
+
+User: "وظیفه شماره 2 رو تمام کن"
+Response: EXECUTE_FUNCTION: complete_task | {"task_number": "2"}
+
+User: "30 دقیقه دیگر یادم بنداز قرار ملاقات دارم"
+Response: EXECUTE_FUNCTION: set_reminder | {"time": "30m", "description": "قرار ملاقات"}
+
+User: "چه خبر؟"
+Response: (normal conversation in Persian)
+
+Current context: """
+SYSTEM_PROMPT_SUFFIX = """
+
+Respond in Persian and be friendly and helpful."""
+
+# Content for get_tip / get_quote
+TIPS = (
+    "💡 **برنامه‌نویسی:** همیشه کدتان را مستند کنید!",
+    "🌐 **شبکه:** TCP قابل اطمینان، UDP سریع‌تر است.",
+    "🔒 **امنیت:** رمزها را هاردکد نکنید، از متغیرهای محیطی استفاده کنید.",
+    "⚡ **کارایی:** الگوریتم O(n) بهتر از O(n²) است.",
+    "🐍 **Python:** از List Comprehension استفاده کنید: [x*2 for x in range(10)]",
+    "🗄️ **دیتابیس:** ایندکس روی ستون‌های پرجستجو سرعت را افزایش می‌دهد.",
+    "🔧 **Git:** از git stash برای ذخیره موقت استفاده کنید.",
+    "🎯 **تست:** کد بدون تست مثل ماشین بدون ترمز است!",
+)
+
+QUOTES = (
+    "💫 \"تنها راه انجام کار عالی این است که آنچه انجام می‌دهید را دوست داشته باشید.\" - استیو جابز",
+    "🌟 \"موفقیت نهایی نیست، شکست کشنده نیست: شجاعت ادامه دادن اهمیت دارد.\" - چرچیل",
+    "🚀 \"آینده متعلق به کسانی است که به رویاهایشان ایمان دارند.\" - الینور روزولت",
+    "💎 \"موفقیت مجموع تلاش‌های کوچک روزانه است.\" - رابرت کلیر",
+    "🌈 \"هر روز فرصت جدیدی است. امروز را بهترین روز زندگی‌تان کنید.\"",
+)
+
+POPULAR_MODELS = (
+    "anthropic/claude-3.5-sonnet",
+    "openai/gpt-4-turbo",
+    "openai/gpt-3.5-turbo",
+    "google/gemini-pro",
+    "meta-llama/llama-3-70b-instruct",
+)
+
+# /model reply; the placeholder is the user's current model
+MODELS_TEXT = """🧠 **مدل فعلی:** {}
+
+**مدل‌های محبوب:**
+""" + "\n".join(f"• {model}" for model in POPULAR_MODELS) + """
+
+💡 برای تغییر: /model <نام مدل>
+مثال: /model openai/gpt-4-turbo"""
+
+# /help reply; placeholders are the AI status mark and the active model
+HELP_TEXT = """🤖 **راهنمای کامل جاروِیس**
+
+✨ **گفتگوی طبیعی (جدید!):**
+فقط به زبان طبیعی بگویید چه می‌خواهید:
+
+📋 **وظایف:**
+• "یه وظیفه اضافه کن: متن وظیفه"
+• "وظایفم رو نشون بده"
+• "وظیفه شماره X رو تمام کن"
+
+📝 **یادداشت:**
+• "یادداشت کن: متن"
+• "یادداشت‌هام رو نشون بده"
+
+⏰ **یادآوری:**
+• "30 دقیقه دیگر یادم بنداز: متن"
+• "2 ساعت دیگر یادآوری بذار: متن"
+
+🧠 **سایر موارد:**
+• "یه نکته آموزشی بگو"
+• "انگیزه‌ام کم شده، کمکم کن"
+• "خلاصه امروزم رو بده"
+
+🎯 **دستورات سنتی (اختیاری):**
+• /addtask, /listtasks, /done
+• /note, /mynotes, /remindme
+• /learn, /quote, /summary
+
+🤖 **تنظیمات AI:**
+• /ai on/off - فعال/غیرفعال کردن
+• /model - تغییر مدل AI
+• /clear - پاک کردن حافظه گفتگو
+
+⚙️ **سایر تنظیمات:**
+• /offline, /online, /voice
+
+AI فعال: {}
+مدل فعال: {}
+
+💡 **نکته:** حالا کافی است فقط بنویسید چه می‌خواهید!"""
 
 # Logging setup
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(created).3f - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=32)
+def system_messages(context: str) -> tuple:
+    """Leading system message for a conversation context, built once per context"""
+    return ({"role": "system", "content": SYSTEM_PROMPT_PREFIX + context + SYSTEM_PROMPT_SUFFIX},)
+
 class JarvisBot:
+    # Hot offline-message/callback statements; identical SQL text lets sqlite3
+    # reuse the prepared statement from the connection's statement cache
+    _SQL_INSERT_OFFLINE = "INSERT INTO offline_messages (user_id, username, first_name, message, received_at) VALUES (?, ?, ?, ?, ?)"
+    _SQL_TAKE_OFFLINE = "DELETE FROM offline_messages RETURNING username, first_name, message, received_at"
+    _SQL_DELETE_TASKS = "DELETE FROM tasks WHERE user_id = ?"
+
+    # Reply templates; only the %s pieces are filled in per message
+    _TPL_OFFLINE = "📴 **حالت آفلاین فعال شد**\n\n💬 %s"
+    _TPL_ONLINE = "✅ **بازگشت به حالت آنلاین**\n\nجاروِیس آماده خدمت!"
+    _TPL_ONLINE_HEADER = "📱 **پیام‌های آفلاین:**\n\n"
+    _TPL_ONLINE_ENTRY = "👤 %s (%s):\n💬 %s\n\n"
+    _TPL_REMINDER = "⏰ **یادآوری:**\n🔔 %s"
+
     def __init__(self):
         self.token = BOT_TOKEN
         self.owner_id = OWNER_ID
+        self._owners = frozenset({OWNER_ID})
+        # Bound set lookup: owner checks run in C without a Python method call
+        self.is_owner = self._owners.__contains__
         self.application = None
+        self._handlers_set = False
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
         self.scheduler = AsyncIOScheduler(event_loop=self.loop)
         self.db_path = DATABASE_PATH
         self.offline_mode = False
+        # offline_messages rows waiting for the next batched write; oldest dropped when full
+        self._offline_buf = deque(maxlen=OFFLINE_BUFFER_MAX)
+        self._offline_lock = asyncio.Lock()
+        self._offline_count_by_user = {}  # user_id -> messages received since /offline
         self.offline_message = "🤖 جاروِیس در حال حاضر آفلاین است. پیام شما ثبت شد و بعداً پاسخ داده خواهد شد."
+        # callback_data -> handler coroutine taking the CallbackQuery
+        self._cb_handlers = {
+            "clear_tasks_yes": self._cb_clear_yes,
+            "clear_tasks_no": self._cb_clear_no,
+        }
         
         # AI Configuration
         self.openrouter_api_key = OPENROUTER_API_KEY
         self.ai_enabled = OPENROUTER_API_KEY != "YOUR_OPENROUTER_API_KEY"
         self.default_model = DEFAULT_MODEL
-        self.conversation_memory = {}
+        self._settings_cache = {}  # user_id -> {"ai_enabled", "ai_model"}
+        self._ai_conv_buf = []  # ai_conversations rows waiting for the next batched write
+        self._ai_conv_lock = asyncio.Lock()
+        # user_id -> last 6 messages, least recently active user first
+        self.conversation_memory = OrderedDict()
+        self.http = None  # aiohttp.ClientSession, created in post_init
+        self._or_url = f"{OPENROUTER_BASE_URL}/chat/completions"
+        self._or_headers = {
+            "Authorization": f"Bearer {self.openrouter_api_key}",
+            "Content-Type": "application/json",
+        }
         
-        # Initialize database
+        # Initialize database (one long-lived connection shared by all handlers)
+        self.conn = self._connect()
+        self._db_lock = threading.Lock()  # guards self.conn across the loop and database threads
+        # Single worker so database calls run off the event loop but stay serialized
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jarvis-db")
         self.init_database()
+        self.load_user_settings()
+        self.scheduler.add_job(self.optimize_database, IntervalTrigger(minutes=15), id="optimize_database")
+        self.scheduler.add_job(self.flush_ai_conversations, IntervalTrigger(seconds=2), id="flush_ai_conversations")
+        self.scheduler.add_job(self.flush_offline_messages, IntervalTrigger(seconds=3), id="flush_offline_messages")
         
+    def _connect(self) -> sqlite3.Connection:
+        """Open a database connection with the tuning pragmas applied"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        # WAL silently falls back on filesystems without shared memory support
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode != "wal":
+            logger.warning("SQLite WAL mode unavailable, using %s journal", journal_mode)
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run the enclosed statements as one transaction on the shared connection"""
+        with self._db_lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            else:
+                cursor.execute("COMMIT")
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        """Execute one statement on the shared connection and return its rows"""
+        with self._db_lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _executemany(self, sql: str, rows: list):
+        """Execute a statement for many parameter rows in one transaction"""
+        with self._transaction() as cursor:
+            cursor.executemany(sql, rows)
+
+    async def run_db(self, func, *args):
+        """Run a blocking database call on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+
+    async def db_query(self, sql: str, params: tuple = ()) -> list:
+        """Execute one statement without blocking the event loop"""
+        return await self.run_db(self._query, sql, params)
+
     def init_database(self):
         """Initialize SQLite database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.conn.cursor()
         
         # Create tables
         tables = [
@@ -99,14 +375,14 @@ class JarvisBot:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 description TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                 completed BOOLEAN DEFAULT FALSE
             )''',
             '''CREATE TABLE IF NOT EXISTS notes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )''',
             '''CREATE TABLE IF NOT EXISTS reminders (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -130,7 +406,7 @@ class JarvisBot:
                 username TEXT,
                 first_name TEXT,
                 message TEXT NOT NULL,
-                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                received_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )''',
             '''CREATE TABLE IF NOT EXISTS ai_conversations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -138,19 +414,55 @@ class JarvisBot:
                 message TEXT NOT NULL,
                 response TEXT NOT NULL,
                 model_used TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )'''
         ]
         
-        for table in tables:
-            cursor.execute(table)
+        # Indexes backing the per-user lookups
+        indexes = [
+            'CREATE INDEX IF NOT EXISTS idx_tasks_uid_comp_ts ON tasks(user_id, completed, created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_notes_uid_ts ON notes(user_id, created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_reminders_uid_completed ON reminders(user_id, completed, reminder_time)',
+            'CREATE INDEX IF NOT EXISTS idx_ai_conv_uid_ts ON ai_conversations(user_id, created_at)',
+        ]
+        
+        for statement in tables + indexes:
+            cursor.execute(statement)
+        
+        # Schema version 1: created_at holds unix seconds instead of ISO text.
+        # Older databases keep their CURRENT_TIMESTAMP defaults, so inserts pass
+        # created_at explicitly and existing rows are converted once here.
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version < 1:
+            with self._transaction() as tx:
+                for table in ("tasks", "notes", "ai_conversations"):
+                    tx.execute(f"UPDATE {table} SET created_at = CAST(strftime('%s', created_at) AS INTEGER) WHERE typeof(created_at) = 'text'")
+                tx.execute("PRAGMA user_version = 1")
+        # Schema version 2: offline_messages.received_at holds unix seconds too
+        if version < 2:
+            with self._transaction() as tx:
+                tx.execute("UPDATE offline_messages SET received_at = CAST(strftime('%s', received_at) AS INTEGER) WHERE typeof(received_at) = 'text'")
+                tx.execute("PRAGMA user_version = 2")
+        
+        # Gather planner statistics once; PRAGMA optimize keeps them fresh afterwards
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            cursor.execute("ANALYZE")
         
-        conn.commit()
-        conn.close()
         logger.info("Database initialized successfully")
 
-    def is_owner(self, user_id: int) -> bool:
-        return user_id == self.owner_id
+    def load_user_settings(self):
+        """Fill the settings cache with every stored row"""
+        for user_id, ai_enabled, ai_model in self._query("SELECT user_id, ai_enabled, ai_model FROM settings"):
+            self._settings_cache[user_id] = {"ai_enabled": bool(ai_enabled), "ai_model": ai_model or self.default_model}
+
+    async def optimize_database(self):
+        """Periodically let SQLite refresh its query planner statistics"""
+        try:
+            await self.db_query("PRAGMA optimize")
+        except Exception as e:
+            logger.error("Error optimizing database: %s", e)
 
     async def execute_function(self, function_name: str, parameters: dict, user_id: int) -> str:
         """Execute bot functions based on AI interpretation"""
@@ -160,28 +472,19 @@ class JarvisBot:
                 if not description:
                     return "❌ نیاز به توضیحات وظیفه دارم."
                 
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO tasks (user_id, description) VALUES (?, ?)", (user_id, description))
-                conn.commit()
-                conn.close()
+                await self.db_query("INSERT INTO tasks (user_id, description, created_at) VALUES (?, ?, ?)", (user_id, description, int(time.time())))
                 return f"✅ وظیفه اضافه شد: {description}"
             
             elif function_name == "list_tasks":
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, description, created_at FROM tasks WHERE user_id = ? AND completed = FALSE ORDER BY created_at", (user_id,))
-                tasks = cursor.fetchall()
-                conn.close()
+                tasks = await self.db_query("SELECT id, description, created_at FROM tasks WHERE user_id = ? AND completed = FALSE ORDER BY created_at, id", (user_id,))
                 
                 if not tasks:
                     return "📋 هیچ وظیفه‌ای در لیست نیست!"
                 
-                result = "📋 **وظایف باقی‌مانده:**\n\n"
-                for i, (task_id, description, created_at) in enumerate(tasks, 1):
-                    date = datetime.fromisoformat(created_at).strftime('%m/%d')
-                    result += f"{i}. {description} 📅 {date}\n"
-                return result
+                parts = ["📋 **وظایف باقی‌مانده:**\n\n"]
+                for task_id, description, created_at in tasks:
+                    parts.append(f"#{task_id} {description} 📅 {datetime.fromtimestamp(created_at):%m/%d}\n")
+                return "".join(parts)
             
             elif function_name == "complete_task":
                 task_number = parameters.get("task_number")
@@ -189,23 +492,20 @@ class JarvisBot:
                     return "❌ کدام وظیفه را تکمیل کنم؟ شماره آن را بگویید."
                 
                 try:
-                    task_number = int(task_number)
-                except:
+                    # list_tasks shows ids as "#12", so the model may echo the "#"
+                    task_number = int(str(task_number).strip().lstrip("#"))
+                except (TypeError, ValueError):
                     return "❌ شماره وظیفه باید عدد باشد."
                 
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, description FROM tasks WHERE user_id = ? AND completed = FALSE ORDER BY created_at", (user_id,))
-                tasks = cursor.fetchall()
-                
-                if not tasks or task_number < 1 or task_number > len(tasks):
-                    conn.close()
+                # Task numbers are the row ids shown by list_tasks
+                rows = await self.db_query(
+                    "UPDATE tasks SET completed = TRUE WHERE id = ? AND user_id = ? AND completed = FALSE RETURNING description",
+                    (task_number, user_id)
+                )
+                if not rows:
                     return "❌ شماره وظیفه نامعتبر است."
                 
-                task_id, description = tasks[task_number - 1]
-                cursor.execute("UPDATE tasks SET completed = TRUE WHERE id = ?", (task_id,))
-                conn.commit()
-                conn.close()
+                description = rows[0][0]
                 return f"🎉 وظیفه تکمیل شد: {description}"
             
             elif function_name == "add_note":
@@ -213,28 +513,19 @@ class JarvisBot:
                 if not content:
                     return "❌ متن یادداشت را وارد کنید."
                 
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO notes (user_id, content) VALUES (?, ?)", (user_id, content))
-                conn.commit()
-                conn.close()
+                await self.db_query("INSERT INTO notes (user_id, content, created_at) VALUES (?, ?, ?)", (user_id, content, int(time.time())))
                 return f"📝 یادداشت ذخیره شد: {content}"
             
             elif function_name == "list_notes":
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT content, created_at FROM notes WHERE user_id = ? ORDER BY created_at DESC LIMIT 10", (user_id,))
-                notes = cursor.fetchall()
-                conn.close()
+                notes = await self.db_query("SELECT content, created_at FROM notes WHERE user_id = ? ORDER BY created_at DESC LIMIT 10", (user_id,))
                 
                 if not notes:
                     return "📝 هیچ یادداشتی موجود نیست!"
                 
-                result = "📝 **یادداشت‌ها:**\n\n"
+                parts = ["📝 **یادداشت‌ها:**\n\n"]
                 for content, created_at in notes:
-                    date = datetime.fromisoformat(created_at).strftime('%m/%d')
-                    result += f"💡 {content} 📅 {date}\n\n"
-                return result
+                    parts.append(f"💡 {content} 📅 {datetime.fromtimestamp(created_at):%m/%d}\n\n")
+                return "".join(parts)
             
             elif function_name == "set_reminder":
                 time_str = parameters.get("time", "")
@@ -248,13 +539,11 @@ class JarvisBot:
                 except ValueError as e:
                     return f"❌ {str(e)}"
                 
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO reminders (user_id, description, reminder_time) VALUES (?, ?, ?)", 
-                              (user_id, description, reminder_time.isoformat()))
-                reminder_id = cursor.lastrowid
-                conn.commit()
-                conn.close()
+                rows = await self.db_query(
+                    "INSERT INTO reminders (user_id, description, reminder_time) VALUES (?, ?, ?) RETURNING id",
+                    (user_id, description, reminder_time.isoformat())
+                )
+                reminder_id = rows[0][0]
                 
                 # Schedule reminder
                 self.scheduler.add_job(
@@ -268,46 +557,27 @@ class JarvisBot:
                 return f"⏰ یادآوری تنظیم شد: {description} در {time_display}"
             
             elif function_name == "get_tip":
-                tips = [
-                    "💡 **برنامه‌نویسی:** همیشه کدتان را مستند کنید!",
-                    "🌐 **شبکه:** TCP قابل اطمینان، UDP سریع‌تر است.",
-                    "🔒 **امنیت:** رمزها را هاردکد نکنید، از متغیرهای محیطی استفاده کنید.",
-                    "⚡ **کارایی:** الگوریتم O(n) بهتر از O(n²) است.",
-                    "🐍 **Python:** از List Comprehension استفاده کنید: [x*2 for x in range(10)]",
-                    "🗄️ **دیتابیس:** ایندکس روی ستون‌های پرجستجو سرعت را افزایش می‌دهد.",
-                    "🔧 **Git:** از git stash برای ذخیره موقت استفاده کنید.",
-                    "🎯 **تست:** کد بدون تست مثل ماشین بدون ترمز است!",
-                ]
-                return random.choice(tips)
+                return random.choice(TIPS)
             
             elif function_name == "get_quote":
-                quotes = [
-                    "💫 \"تنها راه انجام کار عالی این است که آنچه انجام می‌دهید را دوست داشته باشید.\" - استیو جابز",
-                    "🌟 \"موفقیت نهایی نیست، شکست کشنده نیست: شجاعت ادامه دادن اهمیت دارد.\" - چرچیل",
-                    "🚀 \"آینده متعلق به کسانی است که به رویاهایشان ایمان دارند.\" - الینور روزولت",
-                    "💎 \"موفقیت مجموع تلاش‌های کوچک روزانه است.\" - رابرت کلیر",
-                    "🌈 \"هر روز فرصت جدیدی است. امروز را بهترین روز زندگی‌تان کنید.\"",
-                ]
-                return random.choice(quotes)
+                return random.choice(QUOTES)
             
             elif function_name == "get_summary":
+                await self.flush_ai_conversations()
                 today = datetime.now().date()
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ? AND completed = TRUE AND DATE(created_at) = ?", (user_id, today.isoformat()))
-                completed_tasks = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ? AND completed = FALSE", (user_id,))
-                pending_tasks = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM notes WHERE user_id = ? AND DATE(created_at) = ?", (user_id, today.isoformat()))
-                notes_today = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM ai_conversations WHERE user_id = ? AND DATE(created_at) = ?", (user_id, today.isoformat()))
-                ai_conversations = cursor.fetchone()[0]
-                
-                conn.close()
+                # Local day as a [start, end) range of unix seconds, so the indexes apply
+                start = int(datetime.combine(today, datetime.min.time()).timestamp())
+                end = int(datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp())
+                # All four counters in a single round trip
+                rows = await self.db_query(
+                    """SELECT
+                        (SELECT COUNT(*) FROM tasks WHERE user_id = ? AND completed = TRUE AND created_at >= ? AND created_at < ?),
+                        (SELECT COUNT(*) FROM tasks WHERE user_id = ? AND completed = FALSE),
+                        (SELECT COUNT(*) FROM notes WHERE user_id = ? AND created_at >= ? AND created_at < ?),
+                        (SELECT COUNT(*) FROM ai_conversations WHERE user_id = ? AND created_at >= ? AND created_at < ?)""",
+                    (user_id, start, end, user_id, user_id, start, end, user_id, start, end)
+                )
+                completed_tasks, pending_tasks, notes_today, ai_conversations = rows[0]
                 
                 return f"""📊 **خلاصه روزانه - {today.strftime('%Y/%m/%d')}**
 
@@ -322,9 +592,21 @@ class JarvisBot:
                 return f"❌ عملکرد '{function_name}' شناخته شده نیست."
                 
         except Exception as e:
-            logger.error(f"Error executing function {function_name}: {e}")
+            logger.error("Error executing function %s: %s", function_name, e)
             return f"❌ خطا در اجرای عملکرد: {str(e)}"
 
+    def get_conversation(self, user_id: int) -> deque:
+        """Get a user's conversation history, evicting the least recently active users"""
+        history = self.conversation_memory.get(user_id)
+        if history is None:
+            # Older turns are already saved in ai_conversations, so eviction loses nothing
+            history = self.conversation_memory[user_id] = deque(maxlen=6)
+            if len(self.conversation_memory) > MAX_CONVERSATIONS:
+                self.conversation_memory.popitem(last=False)
+        else:
+            self.conversation_memory.move_to_end(user_id)
+        return history
+
     async def get_ai_response(self, user_id: int, message: str, context: str = None) -> str:
         """Get AI response with function calling capability"""
         if not self.ai_enabled:
@@ -332,70 +614,13 @@ class JarvisBot:
 
         try:
             # Get user's conversation history
-            if user_id not in self.conversation_memory:
-                self.conversation_memory[user_id] = []
-
-            # Build enhanced system prompt with function calling
-            system_prompt = f"""You are Jarvis, a helpful Persian/Farsi speaking AI assistant integrated into a Telegram bot. You can understand natural language and execute functions automatically.
-
-IMPORTANT: You can execute the following functions by analyzing user intent:
-
-1. add_task - When user wants to add a task/todo
-   Parameters: {{"description": "task description"}}
-   
-2. list_tasks - When user asks to see tasks/todos
-   Parameters: {{}}
-   
-3. complete_task - When user wants to mark a task as done
-   Parameters: {{"task_number": "number"}}
-   
-4. add_note - When user wants to save a note
-   Parameters: {{"content": "note content"}}
-   
-5. list_notes - When user asks to see notes
-   Parameters: {{}}
-   
-6. set_reminder - When user wants to set a reminder
-   Parameters: {{"time": "time format like 30m, 2h, 1d", "description": "reminder text"}}
-   
-7. get_tip - When user asks for tips or learning
-   Parameters: {{}}
-   
-8. get_quote - When user asks for motivation or quotes
-   Parameters: {{}}
-   
-9. get_summary - When user asks for daily summary
-   Parameters: {{}}
-
-EXECUTION RULES:
-- If user intent matches a function, respond with: EXECUTE_FUNCTION: function_name | parameters_json
-- If multiple functions needed, pick the most relevant one
-- If no function needed, respond normally in Persian
-- Always be conversational and helpful
-
-Examples:
-User: "یه وظیفه اضافه کن: خرید نان"
-Response: EXECUTE_FUNCTION: add_task | {{"description": "خرید نان"}}
-
-User: "وظیفه شماره 2 رو تمام کن"
-Response: EXECUTE_FUNCTION: complete_task | {{"task_number": "2"}}
-
-User: "30 دقیقه دیگر یادم بنداز قرار ملاقات دارم"
-Response: EXECUTE_FUNCTION: set_reminder | {{"time": "30m", "description": "قرار ملاقات"}}
-
-User: "چه خبر؟"
-Response: (normal conversation in Persian)
-
-Current context: {context if context else 'General conversation'}
-
-Respond in Persian and be friendly and helpful."""
+            history = self.get_conversation(user_id)
 
             # Prepare conversation history
-            messages = [{"role": "system", "content": system_prompt}]
+            messages = list(system_messages(context if context else 'General conversation'))
             
             # Add recent conversation history (last 3 messages)
-            for msg in self.conversation_memory[user_id][-3:]:
-                messages.append(msg)
+            messages.extend(islice(history, max(len(history) - 3, 0), None))
             
             # Add current message
             messages.append({"role": "user", "content": message})
@@ -403,76 +628,67 @@ Respond in Persian and be friendly and helpful."""
             # Get user's preferred model
             model = self.get_user_ai_model(user_id)
 
-            headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "Content-Type": "application/json",
-            }
-
-            data = {
+            data = orjson.dumps({
                 "model": model,
                 "messages": messages,
                 "max_tokens": 1000,
                 "temperature": 0.7,
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{OPENROUTER_BASE_URL}/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        ai_response = result['choices'][0]['message']['content']
-                        
-                        # Check if AI wants to execute a function
-                        if ai_response.startswith("EXECUTE_FUNCTION:"):
-                            try:
-                                # Parse function call
-                                parts = ai_response.replace("EXECUTE_FUNCTION:", "").strip().split(" | ")
-                                function_name = parts[0].strip()
-                                parameters = json.loads(parts[1]) if len(parts) > 1 else {}
-                                
-                                # Execute the function
-                                function_result = await self.execute_function(function_name, parameters, user_id)
-                                
-                                # Update conversation memory
-                                self.conversation_memory[user_id].append({"role": "user", "content": message})
-                                self.conversation_memory[user_id].append({"role": "assistant", "content": function_result})
-                                
-                                # Save to database
-                                self.save_ai_conversation(user_id, message, function_result, model)
-                                
-                                return function_result
-                                
-                            except Exception as e:
-                                logger.error(f"Function execution error: {e}")
-                                return f"❌ خطا در اجرای دستور: {str(e)}"
-                        
-                        else:
-                            # Normal conversation
-                            # Update conversation memory
-                            self.conversation_memory[user_id].append({"role": "user", "content": message})
-                            self.conversation_memory[user_id].append({"role": "assistant", "content": ai_response})
+            })
+
+            async with self.http.post(self._or_url, data=data) as response:
+                if response.status == 200:
+                    result = orjson.loads(await response.read())
+                    ai_response = result['choices'][0]['message']['content']
+                    
+                    # Check if AI wants to execute a function
+                    if ai_response.startswith(_FUNC_PREFIX):
+                        try:
+                            # Parse function call; a malformed one is an error, not chat
+                            function_call = _FUNC_RE.match(ai_response)
+                            if function_call is None:
+                                raise ValueError("invalid function call")
+                            function_name, has_params = function_call.groups()
+                            parameters = {}
+                            if has_params:
+                                parameters, _ = _JSON_DECODER.raw_decode(ai_response, function_call.end())
+                                if not isinstance(parameters, dict):
+                                    raise ValueError("function parameters must be a JSON object")
+                            
+                            # Execute the function
+                            function_result = await self.execute_function(function_name, parameters, user_id)
                             
-                            # Keep only last 6 messages in memory
-                            if len(self.conversation_memory[user_id]) > 6:
-                                self.conversation_memory[user_id] = self.conversation_memory[user_id][-6:]
+                            # Update conversation memory
+                            history.append({"role": "user", "content": message})
+                            history.append({"role": "assistant", "content": function_result})
                             
                             # Save to database
-                            self.save_ai_conversation(user_id, message, ai_response, model)
+                            await self.save_ai_conversation(user_id, message, function_result, model)
+                            
+                            return function_result
                             
-                            return ai_response
+                        except Exception as e:
+                            logger.error("Function execution error: %s", e)
+                            return f"❌ خطا در اجرای دستور: {str(e)}"
+                    
                     else:
-                        error_text = await response.text()
-                        logger.error(f"OpenRouter API error: {response.status} - {error_text}")
-                        return f"🚫 خطا در دریافت پاسخ AI: {response.status}"
+                        # Normal conversation
+                        # Update conversation memory
+                        history.append({"role": "user", "content": message})
+                        history.append({"role": "assistant", "content": ai_response})
+                        
+                        # Save to database
+                        await self.save_ai_conversation(user_id, message, ai_response, model)
+                        
+                        return ai_response
+                else:
+                    error_text = await response.text()
+                    logger.error("OpenRouter API error: %s - %s", response.status, error_text)
+                    return f"🚫 خطا در دریافت پاسخ AI: {response.status}"
 
         except asyncio.TimeoutError:
             return "⏱️ زمان انتظار تمام شد. لطفاً دوباره تلاش کنید."
         except Exception as e:
-            logger.error(f"AI response error: {e}")
+            logger.error("AI response error: %s", e)
             return f"🚫 خطا در ارتباط با AI: {str(e)}"
 
     def parse_time_string(self, time_str: str) -> datetime:
@@ -481,122 +697,93 @@ Respond in Persian and be friendly and helpful."""
         time_str = time_str.lower().strip()
         
         # Try to extract number and unit
-        patterns = [
-            r'(\d+)\s*(?:دقیقه|minute|min|m)',
-            r'(\d+)\s*(?:ساعت|hour|h)',
-            r'(\d+)\s*(?:روز|day|d)',
-        ]
-        
-        for i, pattern in enumerate(patterns):
-            match = re.search(pattern, time_str)
+        for pattern, unit in _TIME_PATTERNS:
+            match = pattern.search(time_str)
             if match:
-                value = int(match.group(1))
-                now = datetime.now()
-                
-                if i == 0:  # minutes
-                    return now + timedelta(minutes=value)
-                elif i == 1:  # hours
-                    return now + timedelta(hours=value)
-                elif i == 2:  # days
-                    return now + timedelta(days=value)
-        
-        # Fallback: try basic format
-        pattern = r'^(\d+)([mhd])$'
-        match = re.match(pattern, time_str)
-        
-        if not match:
-            raise ValueError("فرمت زمان: 30m, 2h, 1d یا '30 دقیقه'")
-        
-        value = int(match.group(1))
-        unit = match.group(2)
-        now = datetime.now()
-        
-        if unit == 'm':
-            return now + timedelta(minutes=value)
-        elif unit == 'h':
-            return now + timedelta(hours=value)
-        elif unit == 'd':
-            return now + timedelta(days=value)
+                break
+        else:
+            # Fallback: try basic format
+            match = _TIME_FALLBACK.match(time_str)
+            if not match:
+                raise ValueError("فرمت زمان: 30m, 2h, 1d یا '30 دقیقه'")
+            unit = match.group(2)
+        
+        return datetime.now() + timedelta(**{_TIME_UNITS[unit]: int(match.group(1))})
 
     async def send_reminder(self, user_id: int, description: str, reminder_id: int):
         """Send reminder notification"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE reminders SET completed = TRUE WHERE id = ?", (reminder_id,))
-            conn.commit()
-            conn.close()
+            await self.db_query("UPDATE reminders SET completed = TRUE WHERE id = ?", (reminder_id,))
             
-            message = f"⏰ **یادآوری:**\n🔔 {description}"
+            message = self._TPL_REMINDER % description
             await self.application.bot.send_message(chat_id=user_id, text=message, parse_mode='Markdown')
         except Exception as e:
-            logger.error(f"Error sending reminder: {e}")
+            logger.error("Error sending reminder: %s", e)
+
+    async def save_ai_conversation(self, user_id: int, message: str, response: str, model: str):
+        """Save AI conversation to database (batched, see flush_ai_conversations)"""
+        self._ai_conv_buf.append((user_id, message, response, model, int(time.time())))
+        if len(self._ai_conv_buf) >= AI_CONV_BATCH_SIZE:
+            await self.flush_ai_conversations()
+
+    async def flush_ai_conversations(self):
+        """Write buffered AI conversations in a single transaction"""
+        async with self._ai_conv_lock:
+            if not self._ai_conv_buf:
+                return
+            rows, self._ai_conv_buf = self._ai_conv_buf, []
+            try:
+                await self.run_db(
+                    self._executemany,
+                    "INSERT INTO ai_conversations (user_id, message, response, model_used, created_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+            except Exception as e:
+                logger.error("Error saving AI conversation: %s", e)
 
-    def save_ai_conversation(self, user_id: int, message: str, response: str, model: str):
-        """Save AI conversation to database"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO ai_conversations (user_id, message, response, model_used) VALUES (?, ?, ?, ?)",
-                (user_id, message, response, model)
-            )
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Error saving AI conversation: {e}")
+    def get_user_settings(self, user_id: int) -> dict:
+        """Get user's AI settings from the cache
+
+        The cache is loaded at startup and written through by the setters, so
+        a user missing from it has no settings row and gets the defaults.
+        """
+        settings = self._settings_cache.get(user_id)
+        if settings is None:
+            settings = {"ai_enabled": True, "ai_model": self.default_model}
+            self._settings_cache[user_id] = settings
+        return settings
 
     def get_user_ai_model(self, user_id: int) -> str:
         """Get user's preferred AI model"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT ai_model FROM settings WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result[0] if result and result[0] else self.default_model
-        except:
-            return self.default_model
+        return self.get_user_settings(user_id)["ai_model"]
 
     def is_user_ai_enabled(self, user_id: int) -> bool:
         """Check if AI is enabled for user"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("SELECT ai_enabled FROM settings WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result[0] if result is not None else True
-        except:
-            return True
-
-    def set_user_ai_setting(self, user_id: int, enabled: bool):
+        return self.get_user_settings(user_id)["ai_enabled"]
+
+    async def set_user_ai_setting(self, user_id: int, enabled: bool):
         """Set user AI enabled/disabled"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO settings (user_id, ai_enabled) VALUES (?, ?)",
+            await self.db_query(
+                "INSERT INTO settings (user_id, ai_enabled) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET ai_enabled = excluded.ai_enabled",
                 (user_id, enabled)
             )
-            conn.commit()
-            conn.close()
+            self.get_user_settings(user_id)["ai_enabled"] = enabled
         except Exception as e:
-            logger.error(f"Error setting AI preference: {e}")
+            logger.error("Error setting AI preference: %s", e)
 
-    def set_user_ai_model(self, user_id: int, model: str):
+    async def set_user_ai_model(self, user_id: int, model: str):
         """Set user's preferred AI model"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO settings (user_id, ai_model) VALUES (?, ?)",
+            await self.db_query(
+                "INSERT INTO settings (user_id, ai_model) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET ai_model = excluded.ai_model",
                 (user_id, model)
             )
-            conn.commit()
-            conn.close()
+            self.get_user_settings(user_id)["ai_model"] = model
         except Exception as e:
-            logger.error(f"Error setting AI model: {e}")
+            logger.error("Error setting AI model: %s", e)
 
     # Command Handlers
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -639,46 +826,8 @@ Respond in Persian and be friendly and helpful."""
             await update.message.reply_text("🚫 دسترسی محدود")
             return
         
-        help_text = f"""🤖 **راهنمای کامل جاروِیس**
-
-✨ **گفتگوی طبیعی (جدید!):**
-فقط به زبان طبیعی بگویید چه می‌خواهید:
-
-📋 **وظایف:**
-• "یه وظیفه اضافه کن: متن وظیفه"
-• "وظایفم رو نشون بده"
-• "وظیفه شماره X رو تمام کن"
-
-📝 **یادداشت:**
-• "یادداشت کن: متن"
-• "یادداشت‌هام رو نشون بده"
-
-⏰ **یادآوری:**
-• "30 دقیقه دیگر یادم بنداز: متن"
-• "2 ساعت دیگر یادآوری بذار: متن"
-
-🧠 **سایر موارد:**
-• "یه نکته آموزشی بگو"
-• "انگیزه‌ام کم شده، کمکم کن"
-• "خلاصه امروزم رو بده"
-
-🎯 **دستورات سنتی (اختیاری):**
-• /addtask, /listtasks, /done
-• /note, /mynotes, /remindme
-• /learn, /quote, /summary
-
-🤖 **تنظیمات AI:**
-• /ai on/off - فعال/غیرفعال کردن
-• /model - تغییر مدل AI
-• /clear - پاک کردن حافظه گفتگو
-
-⚙️ **سایر تنظیمات:**
-• /offline, /online, /voice
-
-AI فعال: {'✅' if self.ai_enabled else '❌'}
-مدل فعال: {self.get_user_ai_model(self.owner_id)}
-
-💡 **نکته:** حالا کافی است فقط بنویسید چه می‌خواهید!"""
+        current_model = self.get_user_ai_model(self.owner_id)
+        help_text = HELP_TEXT.format('✅' if self.ai_enabled else '❌', current_model)
         
         await update.message.reply_text(help_text, parse_mode='Markdown')
 
@@ -692,10 +841,10 @@ AI فعال: {'✅' if self.ai_enabled else '❌'}
         if context.args:
             setting = context.args[0].lower()
             if setting in ['on', 'enable', 'فعال']:
-                self.set_user_ai_setting(user_id, True)
+                await self.set_user_ai_setting(user_id, True)
                 message = "🤖 AI فعال شد! حالا می‌توانید با زبان طبیعی با من گفتگو کنید."
             elif setting in ['off', 'disable', 'غیرفعال']:
-                self.set_user_ai_setting(user_id, False)
+                await self.set_user_ai_setting(user_id, False)
                 message = "🚫 AI غیرفعال شد. فقط دستورات سنتی کار می‌کنند."
             else:
                 message = "❌ استفاده: /ai on یا /ai off"
@@ -716,26 +865,11 @@ AI فعال: {'✅' if self.ai_enabled else '❌'}
         
         if context.args:
             new_model = ' '.join(context.args)
-            self.set_user_ai_model(user_id, new_model)
+            await self.set_user_ai_model(user_id, new_model)
             message = f"🧠 مدل AI تغییر کرد به: {new_model}"
         else:
             current_model = self.get_user_ai_model(user_id)
-            popular_models = [
-                "anthropic/claude-3.5-sonnet",
-                "openai/gpt-4-turbo",
-                "openai/gpt-3.5-turbo",
-                "google/gemini-pro",
-                "meta-llama/llama-3-70b-instruct"
-            ]
-            
-            models_text = "\n".join([f"• {model}" for model in popular_models])
-            message = f"""🧠 **مدل فعلی:** {current_model}
-
-**مدل‌های محبوب:**
-{models_text}
-
-💡 برای تغییر: /model <نام مدل>
-مثال: /model openai/gpt-4-turbo"""
+            message = MODELS_TEXT.format(current_model)
         
         await update.message.reply_text(message, parse_mode='Markdown')
 
@@ -758,52 +892,77 @@ AI فعال: {'✅' if self.ai_enabled else '❌'}
             self.offline_message = ' '.join(context.args)
         
         self.offline_mode = True
-        message = f"📴 **حالت آفلاین فعال شد**\n\n💬 {self.offline_message}"
+        message = self._TPL_OFFLINE % self.offline_message
         await update.message.reply_text(message, parse_mode='Markdown')
 
+    async def flush_offline_messages(self):
+        """Write buffered offline messages in a single transaction"""
+        async with self._offline_lock:
+            if not self._offline_buf:
+                return
+            rows = list(self._offline_buf)
+            self._offline_buf.clear()
+            try:
+                await self.run_db(self._executemany, self._SQL_INSERT_OFFLINE, rows)
+            except Exception as e:
+                logger.error("Error saving offline messages: %s", e)
+
     async def set_online(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not self.is_owner(update.effective_user.id):
             return
         
         self.offline_mode = False
+        self._offline_count_by_user.clear()
         
         # Show offline messages
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT username, first_name, message, received_at FROM offline_messages ORDER BY received_at DESC LIMIT 10")
-        messages = cursor.fetchall()
-        cursor.execute("DELETE FROM offline_messages")
-        conn.commit()
-        conn.close()
+        await self.flush_offline_messages()
+        # Read and clear the table in one statement; every message is returned
+        messages = await self.db_query(self._SQL_TAKE_OFFLINE)
         
         if messages:
-            summary = "📱 **پیام‌های آفلاین:**\n\n"
+            # RETURNING order is unspecified; show newest first
+            messages.sort(key=lambda row: row[3], reverse=True)
+            parts = [self._TPL_ONLINE_HEADER]
+            size = len(self._TPL_ONLINE_HEADER)
             for username, first_name, message, received_at in messages:
                 name = username or first_name or "ناشناس"
-                time_str = datetime.fromisoformat(received_at).strftime('%m/%d %H:%M')
-                summary += f"👤 {name} ({time_str}):\n💬 {message}\n\n"
-            await update.message.reply_text(summary, parse_mode='Markdown')
+                time_str = time.strftime('%m/%d %H:%M', time.localtime(received_at))
+                entry = (self._TPL_ONLINE_ENTRY % (name, time_str, message))[:TELEGRAM_MAX_MESSAGE]
+                # Split into several replies instead of exceeding Telegram's limit
+                if size + len(entry) > TELEGRAM_MAX_MESSAGE:
+                    await self.send_response(update, "".join(parts))
+                    parts, size = [], 0
+                parts.append(entry)
+                size += len(entry)
+            await self.send_response(update, "".join(parts))
         
-        await update.message.reply_text("✅ **بازگشت به حالت آنلاین**\n\nجاروِیس آماده خدمت!", parse_mode='Markdown')
+        await update.message.reply_text(self._TPL_ONLINE, parse_mode='Markdown')
 
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle all text messages with natural language processing"""
         user_id = update.effective_user.id
         message_text = update.message.text
+        is_owner = user_id in self._owners
         
-        if self.offline_mode and user_id != self.owner_id:
+        if self.offline_mode and not is_owner:
             user = update.effective_user
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO offline_messages (user_id, username, first_name, message) VALUES (?, ?, ?, ?)",
-                          (user.id, user.username, user.first_name, message_text))
-            conn.commit()
-            conn.close()
+            # Cap what a single sender can queue; past the cap reply once, then ignore
+            count = self._offline_count_by_user.get(user.id, 0)
+            if count > OFFLINE_MAX_PER_USER:
+                return
+            self._offline_count_by_user[user.id] = count + 1
+            if count == OFFLINE_MAX_PER_USER:
+                await update.message.reply_text("⏳ پیام‌های زیادی ارسال کرده‌اید. لطفاً تا آنلاین شدن جاروِیس صبر کنید.")
+                return
+            
+            self._offline_buf.append((user.id, user.username, user.first_name, message_text, int(time.time())))
+            if len(self._offline_buf) >= OFFLINE_BATCH_SIZE:
+                await self.flush_offline_messages()
             
             await update.message.reply_text(self.offline_message)
             
-        elif user_id == self.owner_id:
+        elif is_owner:
             # Check if AI is enabled for this user
             if self.ai_enabled and self.is_user_ai_enabled(user_id):
                 # Show typing indicator
@@ -821,19 +980,30 @@ AI فعال: {'✅' if self.ai_enabled else '❌'}
         query = update.callback_query
         await query.answer()
         
-        if query.data == "clear_tasks_yes":
-            user_id = query.from_user.id
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
-            conn.commit()
-            conn.close()
-            await query.edit_message_text("🗑️ همه وظایف پاک شدند!")
-        elif query.data == "clear_tasks_no":
-            await query.edit_message_text("❌ عملیات لغو شد.")
+        handler = self._cb_handlers.get(query.data)
+        if handler:
+            await handler(query)
+
+    async def _cb_clear_yes(self, query):
+        """Delete all of the user's tasks after confirmation"""
+        await self.db_query(self._SQL_DELETE_TASKS, (query.from_user.id,))
+        await query.edit_message_text("🗑️ همه وظایف پاک شدند!")
+
+    async def _cb_clear_no(self, query):
+        """Cancel the clear-tasks confirmation"""
+        await query.edit_message_text("❌ عملیات لغو شد.")
+
+    @staticmethod
+    def _needs_markdown(message: str) -> bool:
+        """Whether the message contains any Markdown control characters"""
+        return any(c in message for c in "*_`[")
 
     async def send_response(self, update: Update, message: str):
         """Send response to user"""
+        # Plain text can't fail Markdown parsing, so skip the parse-and-retry path
+        if not self._needs_markdown(message):
+            await update.message.reply_text(message)
+            return
         try:
             await update.message.reply_text(message, parse_mode='Markdown')
         except Exception as e:
@@ -842,6 +1012,10 @@ AI فعال: {'✅' if self.ai_enabled else '❌'}
 
     def setup_handlers(self):
         """Setup all command handlers"""
+        # Registering twice would fire every handler twice per update
+        if self._handlers_set:
+            return
+        self._handlers_set = True
         handlers = [
             CommandHandler("start", self.start_command),
             CommandHandler("help", self.help_command),
@@ -857,16 +1031,48 @@ AI فعال: {'✅' if self.ai_enabled else '❌'}
         for handler in handlers:
             self.application.add_handler(handler)
 
-    async def run(self):
-        """Run the bot"""
-        self.application = Application.builder().token(self.token).build()
-        self.setup_handlers()
+    async def post_init(self, application: Application):
+        """Create resources that need a running event loop"""
+        # One pooled session for all OpenRouter calls keeps connections alive;
+        # the auth headers are attached once here instead of on every post
+        self.http = aiohttp.ClientSession(
+            headers=self._or_headers,
+            timeout=aiohttp.ClientTimeout(total=30),
+            connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300, keepalive_timeout=60),
+        )
         
-        # Start the scheduler
+        # AsyncIOScheduler runs the jobs as coroutines on this same loop
         self.scheduler.start()
         logger.info("Scheduler started")
 
-        await self.application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    async def post_shutdown(self, application: Application):
+        """Release resources created in post_init"""
+        # Stop the periodic flushes before the final ones below; the scheduler
+        # never started if Application.initialize() failed before post_init
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        if self.http is not None:
+            await self.http.close()
+        await self.flush_ai_conversations()
+        await self.flush_offline_messages()
+        self._db_executor.shutdown(wait=True)
+        self.conn.close()
+
+    def run(self):
+        """Run the bot"""
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+        self.setup_handlers()
+
+        # run_polling is blocking and drives self.loop itself (including the
+        # post_init/post_shutdown hooks). Only request the update kinds the
+        # handlers consume; Telegram then never sends the rest.
+        self.application.run_polling(allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY], drop_pending_updates=True, timeout=30)
 
 def main():
     """Main function"""
@@ -897,44 +1103,14 @@ def main():
         print("✅ Enhanced Jarvis is ready! You can now use natural language.")
         print("💬 Try: 'یه وظیفه اضافه کن: خرید نان'")
 
-        application = Application.builder().token(bot.token).build()
-        bot.application = application
-        bot.setup_handlers()
-        bot.scheduler.start()
-        logger.info("Scheduler started")
-
-        # Use the bot's asyncio loop
-        bot.loop.run_until_complete(application.initialize())
-        bot.loop.run_until_complete(application.start())
-        bot.loop.run_until_complete(application.updater.start_polling())
-        bot.loop.run_forever()
+        # Run the bot
+        bot.run()
 
     except KeyboardInterrupt:
         print("\n🛑 Bot stopped")
     except Exception as e:
         print(f"❌ Error: {e}")
-        logger.error(f"Main error: {e}")
+        logger.error("Main error: %s", e)
 
 if __name__ == "__main__":
-    print("🚀 Starting Enhanced Jarvis Bot...")
-    
-    try:
-        bot = JarvisBot()
-        
-        if bot.ai_enabled:
-            print("🤖 AI features: ENABLED")
-            print("✨ Natural Language Processing: ENABLED")
-            print(f"🧠 Default model: {bot.default_model}")
-        else:
-            print("🚫 AI features: DISABLED (API key not set)")
-        
-        print("✅ Enhanced Jarvis is ready!")
-        
-        # Run the bot
-        bot.loop.run_until_complete(bot.run())
-        
-    except KeyboardInterrupt:
-        print("\n🛑 Bot stopped")
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        logging.error(f"Main error: {e}")
\ No newline at end of file
+    main()